@@ -1,36 +1,156 @@
 """
-Main Flask Application - Voice Chatbot Backend
+Main Quart Application - Voice Chatbot Backend
 Provides API endpoints for voice-based business insights
 """
 
-from flask import Flask, request, jsonify, send_file
-from flask_cors import CORS
+from quart import Quart, Response, request, jsonify
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
 from dotenv import load_dotenv
+import asyncio
 import os
-import io
-import base64
+import orjson
+import pybase64
 
 # Load environment variables
 load_dotenv()
 
 # Import services
-from services.sarvam_service import SarvamService
+from services.sarvam_service import SarvamService, join_wav
 from services.mongodb_service import MongoDBService
 from services.insights_engine import InsightsEngine
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson, so jsonify() emits UTF-8 bytes in one pass
+    
+    Output differs from Quart's provider for non-ASCII text (e.g. Hindi
+    answers): orjson writes raw UTF-8 where Quart's ensure_ascii=True writes
+    \\uXXXX escapes. Both are valid JSON and decode to the same strings.
+    """
+    
+    def _options(self, sort_keys: bool, indent: bool = False) -> int:
+        # Datetimes are passed to self.default, so they keep Quart's HTTP-date format
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+    
+    def dumps(self, obj, **kwargs) -> str:
+        # orjson has no equivalent for options like indent or separators; use the stdlib for those
+        if set(kwargs) - {'default', 'sort_keys'}:
+            return super().dumps(obj, **kwargs)
+        
+        return orjson.dumps(
+            obj,
+            default=kwargs.get('default', self.default),
+            option=self._options(kwargs.get('sort_keys', self.sort_keys))
+        ).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options(self.sort_keys, indent)),
+            mimetype=self.mimetype
+        )
+
+# Initialize Quart app
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+app = cors(app)  # Enable CORS for frontend
 
 # Initialize services
 sarvam_service = SarvamService()
 mongodb_service = MongoDBService()
 insights_engine = InsightsEngine(mongodb_service)
 
+# ============= LIFECYCLE =============
+
+@app.before_serving
+async def startup():
+    """Open pooled HTTP clients on the serving event loop"""
+    # Confirms pybase64's SIMD codec is active under any server (app.run or uvicorn)
+    print(f"pybase64: {pybase64.get_version()}")
+    
+    await sarvam_service.startup()
+    await insights_engine.startup()
+    
+    if os.getenv('WARMUP', '1') == '1':
+        await warmup()
+
+async def warmup():
+    """
+    Make one TTS call and one Groq/MongoDB round before accepting traffic
+    
+    The first real request then finds TLS connections to Sarvam, Groq and
+    MongoDB already open and the overview context cache populated.
+    """
+    audio, insights = await asyncio.gather(
+        sarvam_service.text_to_speech('Hello', language='en-IN'),
+        insights_engine.warmup(),
+        return_exceptions=True
+    )
+    
+    # text_to_speech returns None on failure; insights_engine.warmup() raises
+    status = {
+        'sarvam': 'ok' if isinstance(audio, bytes) else 'failed',
+        'insights': f'failed ({insights})' if isinstance(insights, Exception) else 'ok'
+    }
+    print(f"Warm-up complete: {status}")
+
+@app.after_serving
+async def shutdown():
+    """Close pooled HTTP clients and the MongoDB connection"""
+    await sarvam_service.aclose()
+    await insights_engine.aclose()
+    mongodb_service.close()
+
+# ============= HELPERS =============
+
+async def speak_response(query: str, lang_code: str, language: str):
+    """
+    Answer a query and synthesize it sentence by sentence
+    
+    TTS for each sentence starts as soon as the LLM finishes decoding it, so
+    synthesis overlaps with the rest of the response. Results are yielded in
+    sentence order as (sentence, audio_bytes) pairs.
+    """
+    pending = asyncio.Queue()
+    
+    async def produce():
+        try:
+            async for sentence in insights_engine.stream_query(query, lang_code):
+                tts_task = asyncio.create_task(
+                    sarvam_service.text_to_speech(sentence, language=language)
+                )
+                await pending.put((sentence, tts_task))
+        finally:
+            await pending.put(None)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await pending.get()) is not None:
+            sentence, tts_task = item
+            yield sentence, await tts_task
+    finally:
+        # The consumer stopped early (e.g. client disconnect): stop decoding and
+        # cancel queued TTS calls so they don't hold limits['tts'] slots
+        producer.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if item is not None:
+                item[1].cancel()
+
 # ============= API ENDPOINTS =============
 
 @app.route('/api/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
@@ -38,25 +158,30 @@ def health_check():
             'sarvam': 'connected',
             'mongodb': 'connected',
             'insights': 'ready'
+        },
+        # Callers waiting for an upstream concurrency slot, for tuning *_CONCURRENCY
+        'queued': {
+            'stt': sarvam_service.limits['stt'].queued,
+            'llm': insights_engine.llm_limit.queued,
+            'tts': sarvam_service.limits['tts'].queued
         }
     })
 
 @app.route('/api/voice/introduction', methods=['GET'])
-def get_introduction():
+async def get_introduction():
     """Get introduction audio"""
     try:
         language = request.args.get('language', 'en-IN')
         
         # Generate introduction audio
-        audio_bytes = sarvam_service.get_introduction_audio(language)
+        audio_bytes = await sarvam_service.get_introduction_audio(language)
         
         if audio_bytes:
-            # Return audio file
-            return send_file(
-                io.BytesIO(audio_bytes),
+            # Return audio bytes directly, no BytesIO wrapper or file handling
+            return Response(
+                audio_bytes,
                 mimetype='audio/wav',
-                as_attachment=False,
-                download_name='introduction.wav'
+                headers={'Content-Disposition': 'inline; filename=introduction.wav'}
             )
         else:
             return jsonify({'error': 'Failed to generate introduction'}), 500
@@ -66,20 +191,21 @@ def get_introduction():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/voice/transcribe', methods=['POST'])
-def transcribe_audio():
+async def transcribe_audio():
     """Convert speech to text"""
     try:
         # Get audio data from request
-        if 'audio' not in request.files:
+        files = await request.files
+        if 'audio' not in files:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        audio_file = request.files['audio']
-        audio_bytes = audio_file.read()
+        audio_file = files['audio']
         
-        language = request.form.get('language', 'en-IN')
+        form = await request.form
+        language = form.get('language', 'en-IN')
         
         # Transcribe using Sarvam AI
-        transcript = sarvam_service.speech_to_text(audio_bytes, language)
+        transcript = await sarvam_service.speech_to_text(audio_file.stream, language)
         
         if transcript:
             return jsonify({
@@ -94,10 +220,10 @@ def transcribe_audio():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/voice/synthesize', methods=['POST'])
-def synthesize_speech():
+async def synthesize_speech():
     """Convert text to speech"""
     try:
-        data = request.get_json()
+        data = await request.get_json()
         
         if not data or 'text' not in data:
             return jsonify({'error': 'No text provided'}), 400
@@ -106,20 +232,27 @@ def synthesize_speech():
         language = data.get('language', 'en-IN')
         speaker = data.get('speaker', 'meera')
         
-        # Generate speech using Sarvam AI
-        audio_bytes = sarvam_service.text_to_speech(
+        # Generate speech using Sarvam AI, streamed sentence by sentence
+        audio_stream = sarvam_service.text_to_speech_stream(
             text,
             language=language,
             speaker=speaker
         )
         
-        if audio_bytes:
-            # Return audio file
-            return send_file(
-                io.BytesIO(audio_bytes),
+        # Wait for the first chunk so a failed synthesis still gets an error status
+        first_chunk = await anext(audio_stream, None)
+        
+        if first_chunk:
+            async def generate():
+                yield first_chunk
+                async for chunk in audio_stream:
+                    yield chunk
+            
+            # Return audio stream
+            return Response(
+                generate(),
                 mimetype='audio/wav',
-                as_attachment=False,
-                download_name='response.wav'
+                headers={'Content-Disposition': 'inline; filename=response.wav'}
             )
         else:
             return jsonify({'error': 'Speech synthesis failed'}), 500
@@ -129,10 +262,10 @@ def synthesize_speech():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/insights/query', methods=['POST'])
-def process_query():
+async def process_query():
     """Process business insights query"""
     try:
-        data = request.get_json()
+        data = await request.get_json()
         
         if not data or 'query' not in data:
             return jsonify({'error': 'No query provided'}), 400
@@ -141,8 +274,16 @@ def process_query():
         language = data.get('language', 'en')
         return_audio = data.get('return_audio', False)
         
-        # Process query through insights engine
-        response_text = insights_engine.process_query(query, language)
+        # Same answer with or without audio: the audio is synthesized from the
+        # text, each sentence concurrently
+        response_text = await insights_engine.process_query(query, language)
+        
+        audio_bytes = None
+        if return_audio:
+            audio_bytes = await sarvam_service.text_to_speech_sentences(
+                response_text,
+                language=f'{language}-IN'
+            )
         
         result = {
             'query': query,
@@ -150,16 +291,9 @@ def process_query():
             'language': language
         }
         
-        # Optionally generate audio response
-        if return_audio:
-            audio_bytes = sarvam_service.text_to_speech(
-                response_text,
-                language=f'{language}-IN'
-            )
-            if audio_bytes:
-                # Encode audio as base64
-                audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-                result['audio'] = audio_base64
+        if audio_bytes:
+            # Encode audio as base64 (SIMD encoder, straight to str)
+            result['audio'] = pybase64.b64encode_as_string(audio_bytes)
         
         return jsonify(result)
     
@@ -168,42 +302,46 @@ def process_query():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/voice/chat', methods=['POST'])
-def voice_chat():
+async def voice_chat():
     """Complete voice chat flow: STT -> Insights -> TTS"""
     try:
         # Get audio data
-        if 'audio' not in request.files:
+        files = await request.files
+        if 'audio' not in files:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        audio_file = request.files['audio']
-        audio_bytes = audio_file.read()
+        audio_file = files['audio']
         
-        language = request.form.get('language', 'en-IN')
+        form = await request.form
+        language = form.get('language', 'en-IN')
         lang_code = language.split('-')[0]  # Extract 'en' from 'en-IN'
         
         # Step 1: Transcribe audio
-        transcript = sarvam_service.speech_to_text(audio_bytes, language)
+        transcript = await sarvam_service.speech_to_text(audio_file.stream, language)
         
         if not transcript:
             return jsonify({'error': 'Transcription failed'}), 500
         
-        # Step 2: Process query
-        response_text = insights_engine.process_query(transcript, lang_code)
+        # Steps 2 & 3: Process query and synthesize each sentence as soon as
+        # the LLM finishes it, so TTS overlaps with the remaining decode
+        sentences = []
+        clips = []
+        async for sentence, audio in speak_response(transcript, lang_code, language):
+            sentences.append(sentence)
+            clips.append(audio)
         
-        # Step 3: Generate speech
-        response_audio = sarvam_service.text_to_speech(
-            response_text,
-            language=language
-        )
+        response_text = ' '.join(sentences)
         
-        if not response_audio:
+        if not clips or not all(clips):
             return jsonify({'error': 'Speech synthesis failed'}), 500
         
+        response_audio = join_wav(clips)
+        
         # Return both text and audio
         return jsonify({
             'transcript': transcript,
             'response_text': response_text,
-            'response_audio': base64.b64encode(response_audio).decode('utf-8'),
+            'response_audio': pybase64.b64encode_as_string(response_audio),
             'language': language
         })
     
@@ -211,18 +349,61 @@ def voice_chat():
         print(f"Voice chat error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/voice/chat/stream', methods=['POST'])
+async def voice_chat_stream():
+    """
+    Streaming voice chat flow: STT -> Insights -> TTS
+    
+    Responds with newline-delimited JSON: a transcript line first, then one
+    line per sentence with its text and base64 WAV audio as soon as that
+    sentence is synthesized, so playback can start after the first sentence.
+    """
+    try:
+        # Get audio data
+        files = await request.files
+        if 'audio' not in files:
+            return jsonify({'error': 'No audio file provided'}), 400
+        
+        audio_file = files['audio']
+        
+        form = await request.form
+        language = form.get('language', 'en-IN')
+        lang_code = language.split('-')[0]  # Extract 'en' from 'en-IN'
+        
+        # Transcribe up front so failures still get a proper status code
+        transcript = await sarvam_service.speech_to_text(audio_file.stream, language)
+        
+        if not transcript:
+            return jsonify({'error': 'Transcription failed'}), 500
+        
+        async def generate():
+            yield orjson.dumps({'transcript': transcript, 'language': language}) + b'\n'
+            
+            async for sentence, audio in speak_response(transcript, lang_code, language):
+                yield orjson.dumps({
+                    'text': sentence,
+                    'audio': pybase64.b64encode_as_string(audio) if audio else None
+                }) + b'\n'
+        
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    except Exception as e:
+        print(f"Voice chat stream error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ============= ERROR HANDLERS =============
 
 @app.errorhandler(404)
-def not_found(error):
+async def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
 @app.errorhandler(500)
-def internal_error(error):
+async def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 # ============= MAIN =============
 
+# Development server only; production runs `uvicorn app:app` (see README)
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
     debug = os.getenv('FLASK_ENV') == 'development'
@@ -244,6 +425,7 @@ API Endpoints:
   POST /api/voice/synthesize
   POST /api/insights/query
   POST /api/voice/chat
+  POST /api/voice/chat/stream
 
 Press CTRL+C to stop
 """)
@@ -0,0 +1,31 @@
+"""
+Deadline Migration
+One-time conversion of ISO-string task deadlines to BSON dates
+
+Overdue checks in MongoDBService only match date deadlines. Run once from
+voice-chatbot-backend/ (safe to re-run; later runs convert nothing):
+
+    python migrate_deadlines.py
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services.mongodb_service import MongoDBService
+
+if __name__ == '__main__':
+    service = MongoDBService()
+    
+    try:
+        result = service.migrate_deadlines()
+        print(f"Converted {result['converted']} string deadlines to dates")
+        
+        # These tasks are invisible to overdue counts until fixed by hand
+        unparseable = result['unparseable']
+        if unparseable:
+            print(f"⚠️  {len(unparseable)} tasks still have unparseable string deadlines:")
+            for task in unparseable:
+                print(f"   {task['_id']} {task.get('title', '')!r}: {task['deadline']!r}")
+    finally:
+        service.close()
@@ -0,0 +1,33 @@
+"""
+Shared Service Helpers
+Definitions used by more than one service module
+"""
+
+import re
+import asyncio
+
+# Sentence boundary: whitespace following terminal punctuation (incl. Devanagari danda)
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?।])\s+')
+
+
+class UpstreamLimit:
+    """
+    Cap on in-flight calls to one upstream API, used as `async with limit:`
+    
+    Bursts wait here for a slot instead of drawing 429s from the upstream.
+    queued counts the callers currently waiting, for tuning the limit.
+    """
+    
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+        self.queued = 0
+    
+    async def __aenter__(self):
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+    
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
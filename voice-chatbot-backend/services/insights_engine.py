@@ -3,20 +3,162 @@ Business Insights Engine
 Processes queries and generates intelligent responses using LLM
 """
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Set, Tuple, Callable, AsyncIterator
+import asyncio
 import os
-from groq import Groq
+import re
+import httpx
+import orjson
+from cachetools import TTLCache
+
+try:
+    from services.common import SENTENCE_BOUNDARY, UpstreamLimit
+except ImportError:  # Run as a script from services/
+    from common import SENTENCE_BOUNDARY, UpstreamLimit
+
+try:
+    import ahocorasick
+except ImportError:  # Optional C extension, fall back to plain substring scans
+    ahocorasick = None
 
 class InsightsEngine:
+    # Team members that can be asked about, in lookup priority order
+    TEAM_MEMBERS = ('Aryan', 'Ritwik', 'Mohak', 'Manu')
+    
+    # Query keywords that pull in each context category
+    CONTEXT_KEYWORDS = {
+        'team': frozenset(('team', 'everyone', 'all', 'performance')),
+        'project': frozenset(('project', 'deadline', 'track', 'health', 'sprint')),
+        'blockers': frozenset(('blocker', 'issue', 'problem', 'stuck'))
+    }
+    
+    # Lowercase keyword -> (category, member name), shared by both matchers
+    _KEYWORD_INDEX = {
+        **{name.lower(): ('name', name) for name in TEAM_MEMBERS},
+        **{keyword: (category, None) for category, keywords in CONTEXT_KEYWORDS.items() for keyword in keywords}
+    }
+    
+    # Fallback matcher: every keyword, found at any position in one regex pass
+    _KEYWORD_PATTERN = re.compile(
+        '(?=(%s))' % '|'.join(sorted(map(re.escape, _KEYWORD_INDEX), key=len, reverse=True))
+    )
+    
+    # Seconds a MongoDB result is reused before it is fetched again
+    CACHE_TTL = 30
+    
+    # Input tokens per LLM call (system prompt + query + context), estimated
+    # at CHARS_PER_TOKEN since JSON context tokenizes at roughly 4 chars/token
+    INPUT_TOKEN_BUDGET = 2048
+    CHARS_PER_TOKEN = 4
+    MESSAGE_OVERHEAD_TOKENS = 64
+    
+    # Context keys by priority; earlier keys get a larger share of the budget
+    CONTEXT_PRIORITY = ('user_status', 'individual_contribution', 'blockers', 'project_health', 'team_performance')
+    
+    # Decode budget for a free-text (streamed) answer and for a JSON-shaped answer
+    MAX_TOKENS = 200
+    STRUCTURED_MAX_TOKENS = 200
+    
+    # Output shape for non-streamed answers; the spoken text is assembled server-side
+    STRUCTURED_FORMAT = (
+        'Reply with a JSON object only, in this shape: '
+        '{"ack": "<brief acknowledgement>", '
+        '"points": ["<key data point>", "<key data point>"], '
+        '"insight": "<one insight or recommendation>", '
+        '"note": "<short encouraging close>"}. '
+        'Use 2-3 points and keep every field to one short sentence.'
+    )
+    
     def __init__(self, mongodb_service):
         self.mongodb = mongodb_service
         
-        # Configure Groq with Llama 3.3 70B Versatile
-        self.client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+        # Configure Groq with Llama 3.3 70B Versatile (AsyncGroq, opened by startup())
+        self.client = None
         self.model = 'llama-3.3-70b-versatile'
         
         # Load system prompt
         self.system_prompt = self._load_system_prompt()
+        
+        # Built once and reused, rather than a new message dict per request
+        self._system_message = {"role": "system", "content": self.system_prompt}
+        self._format_message = {"role": "system", "content": self.STRUCTURED_FORMAT}
+        self._system_tokens = self._estimate_tokens(self.system_prompt)
+        self._format_tokens = self._estimate_tokens(self.STRUCTURED_FORMAT)
+        
+        # In-flight queries, so concurrent identical questions share one LLM call
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        
+        # In-flight Groq call limit
+        self.llm_limit = UpstreamLimit(int(os.getenv('LLM_CONCURRENCY', 8)))
+        
+        # Single-pass keyword matcher for _gather_context
+        self._keyword_automaton = self._build_keyword_automaton()
+        
+        # Short-lived cache of (MongoDB result, serialized prompt text), keyed by (method name, args)
+        self._cache = TTLCache(maxsize=256, ttl=self.CACHE_TTL)
+        
+        # Cache misses being fetched, so concurrent requests share one MongoDB round trip
+        self._fetching: Dict[Tuple[str, tuple], asyncio.Future] = {}
+        
+        # Keyword category -> (context key, MongoDB fetch), resolved once
+        self._context_sources = {
+            'team': ('team_performance', mongodb_service.get_team_performance),
+            'project': ('project_health', mongodb_service.get_project_health),
+            'blockers': ('blockers', mongodb_service.get_blockers)
+        }
+        self._overview_sources = (self._context_sources['team'], self._context_sources['project'])
+    
+    async def startup(self):
+        """Open the Groq client on a pooled HTTP/2 connection (call from the serving event loop)"""
+        if self.client is None:
+            # Deferred so importing this module does not load the Groq SDK (~160 ms)
+            from groq import AsyncGroq
+            
+            self.client = AsyncGroq(
+                api_key=os.getenv('GROQ_API_KEY'),
+                http_client=httpx.AsyncClient(
+                    http2=True,
+                    timeout=30.0,
+                    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+                )
+            )
+    
+    async def aclose(self):
+        """Close the Groq client and its connection pool"""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+    
+    async def warmup(self):
+        """
+        Open the MongoDB and Groq connections with one real call each
+        
+        Fills the overview context cache and makes a one-token completion with
+        the shared system prefix. Raises on failure, unlike process_query,
+        which answers with fallback text.
+        """
+        context = await self._gather_context('')
+        failed = [key for key, (value, _) in context.items() if self._is_failed(value)]
+        if failed:
+            raise RuntimeError(f"MongoDB fetch failed: {', '.join(failed)}")
+        
+        async with self.llm_limit:
+            await self.client.chat.completions.create(
+                model=self.model,
+                messages=[self._system_message, {"role": "user", "content": "ping"}],
+                max_tokens=1
+            )
+    
+    def _build_keyword_automaton(self):
+        """Compile member names and context keywords into one Aho-Corasick automaton"""
+        if ahocorasick is None:
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        for keyword, match in self._KEYWORD_INDEX.items():
+            automaton.add_word(keyword, match)
+        automaton.make_automaton()
+        return automaton
     
     def _load_system_prompt(self) -> str:
         """Load system prompt for AI"""
@@ -43,7 +185,7 @@ Response Format:
 
 Always be helpful, accurate, and encouraging!"""
     
-    def process_query(self, query: str, language: str = 'en') -> str:
+    async def process_query(self, query: str, language: str = 'en') -> str:
         """
         Process user query and generate response
         
@@ -54,83 +196,320 @@ Always be helpful, accurate, and encouraging!"""
         Returns:
             Generated response text
         """
+        key = (query.strip().lower(), language)
+        
+        # Coalesce with an identical query that is already being answered
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._process_query(query, language))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one caller disconnecting doesn't cancel the shared call
+        return await asyncio.shield(task)
+    
+    async def _process_query(self, query: str, language: str) -> str:
+        """Gather context and generate a response for a single query"""
         try:
             # Detect query type and fetch relevant data
-            context = self._gather_context(query)
+            context = await self._gather_context(query)
             
             # Generate response using LLM
-            response = self._generate_response(query, context, language)
+            response = await self._generate_response(query, context, language)
             
             return response
         except Exception as e:
             print(f"Error processing query: {e}")
             return self._get_fallback_response(language)
     
-    def _gather_context(self, query: str) -> Dict[str, Any]:
-        """Gather relevant context based on query"""
-        context = {}
-        query_lower = query.lower()
+    async def stream_query(self, query: str, language: str = 'en') -> AsyncIterator[str]:
+        """
+        Process user query and yield the response one sentence at a time
         
-        # Detect query type and fetch data
-        if any(name in query_lower for name in ['aryan', 'ritwik', 'mohak', 'manu']):
-            # Individual status query
-            for name in ['Aryan', 'Ritwik', 'Mohak', 'Manu']:
-                if name.lower() in query_lower:
-                    context['user_status'] = self.mongodb.get_user_status(name)
-                    context['individual_contribution'] = self.mongodb.get_individual_contribution(name)
-                    break
+        Sentences are yielded as soon as the LLM finishes decoding them, so
+        callers can start speech synthesis before the full response exists.
+        
+        Args:
+            query: User's question
+            language: Language code (en or hi)
+        
+        Yields:
+            Complete sentences of the generated response
+        """
+        try:
+            context = await self._gather_context(query)
+            
+            # The slot is held until the stream is fully decoded
+            async with self.llm_limit:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._build_messages(query, context),
+                    max_tokens=self.MAX_TOKENS,
+                    temperature=0.7,
+                    stream=True
+                )
+                
+                # Closes the HTTP response when the caller stops consuming early
+                async with stream:
+                    buffer = ''
+                    async for chunk in stream:
+                        buffer += chunk.choices[0].delta.content or ''
+                        *sentences, buffer = SENTENCE_BOUNDARY.split(buffer)
+                        for sentence in sentences:
+                            if sentence.strip():
+                                yield sentence.strip()
+            
+            if buffer.strip():
+                yield buffer.strip()
+        except Exception as e:
+            yield self._get_error_response(e, language)
+    
+    def _match_keywords(self, query_lower: str) -> Tuple[Optional[str], Set[str]]:
+        """
+        Find the team member and context categories mentioned in a query
+        
+        Returns:
+            (member name or None, set of matched CONTEXT_KEYWORDS categories)
+        """
+        if self._keyword_automaton is not None:
+            matches = (match for _, match in self._keyword_automaton.iter(query_lower))
+        else:
+            index = self._KEYWORD_INDEX
+            matches = (index[m.group(1)] for m in self._KEYWORD_PATTERN.finditer(query_lower))
+        
+        names = set()
+        categories = set()
+        for category, value in matches:
+            if category == 'name':
+                names.add(value)
+            else:
+                categories.add(category)
+        
+        name = next((n for n in self.TEAM_MEMBERS if n in names), None)
+        return name, categories
+    
+    def _fetch_entry(self, fetch: Callable[..., Any], args: tuple) -> Tuple[Any, str]:
+        """Run a blocking MongoDB fetch and serialize its result for the prompt"""
+        value = fetch(*args)
+        # default=str covers ObjectId and other BSON types orjson doesn't know;
+        # no single value can use more than the whole input budget
+        text = orjson.dumps(value, default=str).decode()[:self.INPUT_TOKEN_BUDGET * self.CHARS_PER_TOKEN]
+        return value, text
+    
+    @staticmethod
+    def _is_failed(value: Any) -> bool:
+        """Whether a MongoDB fetch returned one of its error sentinels"""
+        return value is None or value == {} or (isinstance(value, dict) and value.get('status') == 'error')
+    
+    async def _cached(self, fetch: Callable[..., Any], *args) -> Tuple[Any, str]:
+        """
+        Return fetch(*args) with its truncated JSON form for the prompt
+        
+        Both are reused for CACHE_TTL seconds, so repeated queries skip the
+        MongoDB round trip and the serialization. Misses run in a worker
+        thread since pymongo blocks, and concurrent misses for the same key
+        wait on a single fetch. Failed fetches are not cached, so the next
+        query retries instead of reusing the error.
+        """
+        key = (fetch.__name__, args)
         
-        if any(word in query_lower for word in ['team', 'everyone', 'all', 'performance']):
-            # Team performance query
-            context['team_performance'] = self.mongodb.get_team_performance()
+        entry = self._cache.get(key)
+        if entry is not None:
+            return entry
+        
+        task = self._fetching.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self._fetch_entry, fetch, args))
+            self._fetching[key] = task
+            task.add_done_callback(lambda _: self._fetching.pop(key, None))
+        
+        # Shield so one caller being cancelled doesn't cancel the shared fetch
+        entry = await asyncio.shield(task)
+        if not self._is_failed(entry[0]):
+            self._cache[key] = entry
+        return entry
+    
+    async def _gather_context(self, query: str) -> Dict[str, Tuple[Any, str]]:
+        """Gather relevant context based on query, fetching independent data concurrently"""
+        sources = []
+        name, categories = self._match_keywords(query.lower())
         
-        if any(word in query_lower for word in ['project', 'deadline', 'track', 'health', 'sprint']):
-            # Project health query
-            context['project_health'] = self.mongodb.get_project_health()
+        # Detect query type and pick data to fetch
+        if name:
+            # Individual status query
+            sources.append(('user_status', self.mongodb.get_user_status, (name,)))
+            sources.append(('individual_contribution', self.mongodb.get_individual_contribution, (name,)))
         
-        if any(word in query_lower for word in ['blocker', 'issue', 'problem', 'stuck']):
-            # Blockers query
-            context['blockers'] = self.mongodb.get_blockers()
+        # Team performance, project health and blockers queries
+        for category, (key, fetch) in self._context_sources.items():
+            if category in categories:
+                sources.append((key, fetch, ()))
         
         # If no specific context, get general overview
-        if not context:
-            context['team_performance'] = self.mongodb.get_team_performance()
-            context['project_health'] = self.mongodb.get_project_health()
+        if not sources:
+            sources.extend((key, fetch, ()) for key, fetch in self._overview_sources)
+        
+        entries = await asyncio.gather(*(self._cached(fetch, *args) for _, fetch, args in sources))
+        return {key: entry for (key, _, _), entry in zip(sources, entries)}
+    
+    def _estimate_tokens(self, text: str) -> int:
+        """Rough token count for budgeting"""
+        return len(text) // self.CHARS_PER_TOKEN + 1
+    
+    def _fit_context(self, context: Dict[str, Tuple[Any, str]], budget_chars: int) -> Dict[str, str]:
+        """
+        Truncate context texts to share budget_chars by CONTEXT_PRIORITY
+        
+        Each key gets a share weighted by its priority. Texts shorter than
+        their share are kept whole and the unused characters go back to the
+        keys that still need them.
+        """
+        texts = {key: text for key, (_, text) in context.items()}
+        weights = {
+            key: len(self.CONTEXT_PRIORITY) - self.CONTEXT_PRIORITY.index(key)
+            if key in self.CONTEXT_PRIORITY else 1
+            for key in texts
+        }
         
-        return context
+        fitted = {}
+        pending = list(texts)
+        remaining = budget_chars
+        while pending:
+            total_weight = sum(weights[key] for key in pending)
+            shares = {key: remaining * weights[key] // total_weight for key in pending}
+            
+            short = [key for key in pending if len(texts[key]) <= shares[key]]
+            if not short:
+                fitted.update({key: texts[key][:shares[key]] for key in pending})
+                break
+            
+            for key in short:
+                fitted[key] = texts[key]
+                remaining -= len(texts[key])
+            pending = [key for key in pending if key not in short]
+        
+        # Keep the order the context was gathered in
+        return {key: fitted[key] for key in texts}
+    
+    def _build_messages(
+        self,
+        query: str,
+        context: Dict[str, Tuple[Any, str]],
+        structured: bool = False
+    ) -> List[Dict[str, str]]:
+        """Build chat messages from the system prompt(s), query and context within INPUT_TOKEN_BUDGET"""
+        system_messages = [self._system_message]
+        prompt_tokens = self._system_tokens + self._estimate_tokens(query) + self.MESSAGE_OVERHEAD_TOKENS
+        if structured:
+            system_messages.append(self._format_message)
+            prompt_tokens += self._format_tokens
+        
+        budget_chars = max(self.INPUT_TOKEN_BUDGET - prompt_tokens, 0) * self.CHARS_PER_TOKEN
+        
+        context_str = f"User Query: {query}\n\nAvailable Data:\n"
+        for key, text in self._fit_context(context, budget_chars).items():
+            context_str += f"\n{key}:\n{text}\n"
+        
+        return [
+            *system_messages,
+            {"role": "user", "content": context_str}
+        ]
     
-    def _generate_response(self, query: str, context: Dict[str, Any], language: str) -> str:
+    async def _generate_response(self, query: str, context: Dict[str, Tuple[Any, str]], language: str) -> str:
         """Generate response using Groq Llama 3.3"""
         try:
-            # Build context message
-            context_str = f"User Query: {query}\n\nAvailable Data:\n"
-            for key, value in context.items():
-                context_str += f"\n{key}:\n{str(value)[:500]}\n"  # Limit context size
+            try:
+                return await self._generate_structured(query, context)
+            except ValueError as e:
+                # Cut off at the token cap, or not the expected shape; answer in free text instead
+                print(f"Structured answer unusable, retrying as free text: {e}")
             
-            # Use Groq chat completion
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": context_str}
-                ],
-                max_tokens=200,
-                temperature=0.7
-            )
+            async with self.llm_limit:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._build_messages(query, context),
+                    max_tokens=self.MAX_TOKENS,
+                    temperature=0.7
+                )
             
-            return response.choices[0].message.content.strip()
+            return response.choices[0].message.content
         except Exception as e:
-            error_msg = str(e)
-            print(f"Groq Error: {error_msg}")
-            
-            # Check if it's a quota error
-            if '429' in error_msg or 'quota' in error_msg.lower():
-                return self._get_quota_exceeded_response(language)
-            
-            return self._get_fallback_response(language)
+            return self._get_error_response(e, language)
+    
+    async def _generate_structured(self, query: str, context: Dict[str, Tuple[Any, str]]) -> str:
+        """
+        Generate a STRUCTURED_FORMAT answer and assemble it into spoken text
+        
+        Raises ValueError when the JSON is truncated by STRUCTURED_MAX_TOKENS
+        (a 'length' stop, or Groq's json_validate_failed) or is unusable.
+        """
+        try:
+            # Use Groq chat completion, constrained to a fixed JSON shape so decode stays short
+            async with self.llm_limit:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._build_messages(query, context, structured=True),
+                    max_tokens=self.STRUCTURED_MAX_TOKENS,
+                    temperature=0.7,
+                    response_format={'type': 'json_object'}
+                )
+        except Exception as e:
+            # Groq rejects JSON-mode output it cannot parse, including output cut off at the cap
+            if 'json_validate_failed' in str(e):
+                raise ValueError(f"Structured answer failed validation: {e}") from e
+            raise
+        
+        choice = response.choices[0]
+        if choice.finish_reason == 'length':
+            raise ValueError("Structured answer hit STRUCTURED_MAX_TOKENS")
+        
+        return self._assemble_answer(choice.message.content)
+    
+    def _assemble_answer(self, content: str) -> str:
+        """
+        Join a STRUCTURED_FORMAT answer into one spoken paragraph
+        
+        JSON mode guarantees valid JSON, not the schema, so the shape is
+        checked here. Raises ValueError when nothing speakable is left, which
+        the caller turns into the fallback response.
+        """
+        answer = orjson.loads(content)
+        if not isinstance(answer, dict):
+            raise ValueError(f"Structured answer is not an object: {content[:100]}")
+        
+        # A single point may come back as a plain string rather than a list
+        points = answer.get('points')
+        if isinstance(points, str):
+            points = [points]
+        elif not isinstance(points, list):
+            points = []
+        
+        parts = [answer.get('ack'), *points, answer.get('insight'), answer.get('note')]
+        
+        sentences = []
+        for part in parts:
+            part = str(part or '').strip()
+            if part:
+                sentences.append(part if part[-1] in '.!?।' else f"{part}.")
+        
+        if not sentences:
+            raise ValueError(f"Structured answer has no text: {content[:100]}")
+        
+        return ' '.join(sentences)
+    
+    def _get_error_response(self, error: Exception, language: str) -> str:
+        """Map an LLM error to a user-facing response"""
+        error_msg = str(error)
+        print(f"Groq Error: {error_msg}")
+        
+        # Check if it's a quota error
+        if '429' in error_msg or 'quota' in error_msg.lower():
+            return self._get_quota_exceeded_response(language)
+        
+        return self._get_fallback_response(language)
     
     def _get_quota_exceeded_response(self, language: str) -> str:
-        """Response when Gemini quota is exceeded"""
+        """Response when the Groq quota is exceeded"""
         if language.startswith('hi'):
             return """
             माफ़ करें, AI सर्विस की दैनिक सीमा पूरी हो गई है। 
@@ -165,14 +544,12 @@ How can I help you today?"""
 
 
 # Test function
-if __name__ == '__main__':
-    from dotenv import load_dotenv
+async def _main():
     from mongodb_service import MongoDBService
     
-    load_dotenv()
-    
     mongodb = MongoDBService()
     engine = InsightsEngine(mongodb)
+    await engine.startup()
     
     print("Testing Insights Engine...")
     
@@ -185,8 +562,16 @@ if __name__ == '__main__':
     
     for query in test_queries:
         print(f"\nQuery: {query}")
-        response = engine.process_query(query)
+        response = await engine.process_query(query)
         print(f"Response: {response}")
     
+    await engine.aclose()
     mongodb.close()
     print("\n✅ Insights Engine Test Complete")
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    asyncio.run(_main())
@@ -4,11 +4,40 @@ Connects to MongoDB and retrieves business insights data
 """
 
 from pymongo import MongoClient
-from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timezone
 import os
+import bson
+import time
+import bisect
+import threading
+from collections import Counter
+
+# The pure-Python BSON codec decodes cursors several times slower; fail fast
+# on a deploy where pymongo was built without its C extensions
+if not bson.has_c():
+    raise ImportError("pymongo C extensions not available; reinstall pymongo from a binary wheel")
 
 class MongoDBService:
+    # Fields each lookup actually uses; everything else stays on the server
+    TASK_FIELDS = {'_id': 0, 'title': 1, 'status': 1, 'priority': 1, 'deadline': 1, 'assignee_name': 1}
+    CONTRIBUTOR_FIELDS = {
+        '_id': 0, 'name': 1, 'total_commits': 1, 'total_lines_added': 1,
+        'total_lines_deleted': 1, 'total_lines_changed': 1
+    }
+    RECENT_COMMITS_FIELDS = {**CONTRIBUTOR_FIELDS, 'commits': {'$slice': 5}}
+    JIRA_FIELDS = {'_id': 0, 'name': 1, 'tickets': 1}
+    
+    # Documents per cursor batch for unbounded reads (server default first batch: 101)
+    CURSOR_BATCH_SIZE = 1000
+    
+    # Seconds before the display-name list is reloaded, so new people show up
+    KNOWN_NAMES_TTL = 60
+    
+    # Seconds the shared task dashboard is reused between callers
+    DASHBOARD_TTL = 15
+    
     def __init__(self):
         self.mongo_uri = os.getenv('MONGODB_URI')
         if not self.mongo_uri:
@@ -27,24 +56,180 @@ class MongoDBService:
         self.tasks = self.db['tasks']
         self.users = self.db['users']
         self.projects = self.db['projects']
+        
+        # Runs independent queries of one lookup in parallel (MongoClient is thread-safe)
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='mongodb')
+        
+        # Sorted (lowercased, stored) display names, for resolving who a lookup is about
+        self._known_names: List[Tuple[str, str]] = []
+        self._known_names_expiry = 0.0
+        self._known_names_lock = threading.Lock()
+        
+        # Memoized _compute_dashboard result; the lock also makes concurrent callers share one query
+        self._dashboard: Optional[Dict[str, Any]] = None
+        self._dashboard_expiry = 0.0
+        self._dashboard_lock = threading.Lock()
+    
+    def ensure_indexes(self):
+        """
+        Create the indexes the name and task lookups rely on
+        
+        Run via setup_indexes.py rather than on start-up, so the constructor
+        makes no network calls (the tasks collection belongs to the Node
+        service). A no-op for indexes that already exist.
+        """
+        self.jira_data.create_index('name')
+        self.github_data.create_index('name')
+        self.github_data.create_index([('total_commits', -1)])
+        self.tasks.create_index('assignee_name')
+        self.tasks.create_index([('status', 1), ('deadline', 1)])
+        self.tasks.create_index([('status', 1), ('priority', 1)])
+    
+    def migrate_deadlines(self) -> Dict[str, Any]:
+        """
+        Convert ISO-string task deadlines to BSON dates, in place
+        
+        One-time migration, run via migrate_deadlines.py rather than on
+        start-up (the tasks collection belongs to the Node service). Overdue
+        checks only match date deadlines, so strings that can't be parsed are
+        left as they are and reported for manual fixing.
+        
+        Returns:
+            Number of converted deadlines and the tasks still holding strings
+        """
+        result = self.tasks.update_many(
+            {'deadline': {'$type': 'string'}},
+            [{'$set': {'deadline': {'$convert': {
+                'input': '$deadline',
+                'to': 'date',
+                'onError': '$deadline'
+            }}}}]
+        )
+        
+        remaining = list(self.tasks.find(
+            {'deadline': {'$type': 'string'}},
+            {'_id': 1, 'title': 1, 'deadline': 1},
+            batch_size=self.CURSOR_BATCH_SIZE
+        ))
+        
+        return {
+            'converted': result.modified_count,
+            'unparseable': remaining
+        }
+    
+    @staticmethod
+    def _overdue_filter(now: datetime) -> Dict[str, Any]:
+        """Filter for unfinished tasks whose deadline has passed
+        
+        now should be timezone-aware UTC (read once per call by the caller);
+        pymongo then compares it with the stored UTC dates without ambiguity.
+        """
+        return {
+            'status': {'$ne': 'completed'},
+            'deadline': {'$lt': now}
+        }
+    
+    def _resolve_names(self, user_name: str) -> List[str]:
+        """
+        Stored display names that start with user_name, ignoring case
+        
+        People are asked about by first name ("Aryan") but stored under display
+        names ("Aryan Sharma", "ritwikmohanty"). Resolving the prefix here lets
+        lookups use exact {'$in': names} matches, which MongoDB answers from the
+        name indexes with tight bounds; a case-insensitive regex can't be.
+        The names are reloaded every KNOWN_NAMES_TTL seconds.
+        
+        Returns:
+            Matching names from GitHub, Jira and task assignees ([] if none)
+        """
+        if time.monotonic() >= self._known_names_expiry:
+            with self._known_names_lock:
+                if time.monotonic() >= self._known_names_expiry:
+                    # distinct() is answered from the name indexes
+                    names = (
+                        set(self.github_data.distinct('name'))
+                        | set(self.jira_data.distinct('name'))
+                        | set(self.tasks.distinct('assignee_name'))
+                    )
+                    self._known_names = sorted((n.lower(), n) for n in names if isinstance(n, str))
+                    self._known_names_expiry = time.monotonic() + self.KNOWN_NAMES_TTL
+        
+        prefix = user_name.strip().lower()
+        if not prefix:
+            return []
+        
+        matches = []
+        for lowered, name in self._known_names[bisect.bisect_left(self._known_names, (prefix, '')):]:
+            if not lowered.startswith(prefix):
+                break
+            matches.append(name)
+        return matches
+    
+    def _compute_dashboard(self) -> Dict[str, Any]:
+        """
+        Task figures shared by get_team_performance and get_project_health
+        
+        One $facet over tasks returns the per-status counts, the overdue count
+        and the five longest-overdue tasks. The result is reused for
+        DASHBOARD_TTL seconds; treat it as read-only.
+        """
+        with self._dashboard_lock:
+            if self._dashboard is not None and time.monotonic() < self._dashboard_expiry:
+                return self._dashboard
+            
+            overdue = self._overdue_filter(datetime.now(timezone.utc))
+            pipeline = [
+                {'$facet': {
+                    'statuses': [
+                        {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+                    ],
+                    'overdue_count': [
+                        {'$match': overdue},
+                        {'$count': 'count'}
+                    ],
+                    'overdue_tasks': [
+                        {'$match': overdue},
+                        {'$sort': {'deadline': 1}},
+                        {'$limit': 5},
+                        {'$project': self.TASK_FIELDS}
+                    ]
+                }}
+            ]
+            facets = next(self.tasks.aggregate(pipeline))
+            
+            self._dashboard = {
+                'status_counts': {row['_id']: row['count'] for row in facets['statuses']},
+                'overdue_count': facets['overdue_count'][0]['count'] if facets['overdue_count'] else 0,
+                'overdue_tasks': facets['overdue_tasks']
+            }
+            self._dashboard_expiry = time.monotonic() + self.DASHBOARD_TTL
+            return self._dashboard
     
     def get_user_status(self, user_name: str) -> Optional[Dict[str, Any]]:
         """Get status for a specific user"""
         try:
-            # Get Jira data
-            jira_user = self.jira_data.find_one(
-                {'name': {'$regex': user_name, '$options': 'i'}}
-            )
+            names = self._resolve_names(user_name)
+            if not names:
+                return {'name': user_name, 'jira': None, 'github': None, 'tasks': []}
+            
+            name_filter = {'$in': names}
             
-            # Get GitHub data
-            github_user = self.github_data.find_one(
-                {'name': {'$regex': user_name, '$options': 'i'}}
+            # Get Jira data, GitHub data and tasks concurrently
+            jira_future = self._executor.submit(
+                self.jira_data.find_one, {'name': name_filter}, self.JIRA_FIELDS
+            )
+            github_future = self._executor.submit(
+                self.github_data.find_one, {'name': name_filter}, self.RECENT_COMMITS_FIELDS
+            )
+            tasks_future = self._executor.submit(
+                lambda: list(self.tasks.find(
+                    {'assignee_name': name_filter}, self.TASK_FIELDS, batch_size=self.CURSOR_BATCH_SIZE
+                ))
             )
             
-            # Get tasks
-            user_tasks = list(self.tasks.find(
-                {'assignee_name': {'$regex': user_name, '$options': 'i'}}
-            ))
+            jira_user = jira_future.result()
+            github_user = github_future.result()
+            user_tasks = tasks_future.result()
             
             return {
                 'name': user_name,
@@ -59,45 +244,48 @@ class MongoDBService:
     def get_team_performance(self, days: int = 7) -> Dict[str, Any]:
         """Get team performance metrics"""
         try:
-            # Get all GitHub contributors
-            contributors = list(self.github_data.find())
-            
-            # Get all Jira users
-            jira_users = list(self.jira_data.find())
+            # Commit totals across all contributors
+            commits_pipeline = [
+                {'$group': {
+                    '_id': None,
+                    'total_commits': {'$sum': '$total_commits'},
+                    'total_lines_added': {'$sum': '$total_lines_added'},
+                    'total_lines_deleted': {'$sum': '$total_lines_deleted'}
+                }}
+            ]
             
-            # Get all tasks
-            all_tasks = list(self.tasks.find())
+            commits_future = self._executor.submit(
+                lambda: next(self.github_data.aggregate(commits_pipeline), {})
+            )
+            # Top-5 walk of the total_commits index rather than an in-memory sort
+            top_future = self._executor.submit(
+                lambda: list(self.github_data.find({}, self.CONTRIBUTOR_FIELDS).sort('total_commits', -1).limit(5))
+            )
+            dashboard_future = self._executor.submit(self._compute_dashboard)
             
-            # Calculate metrics
-            total_commits = sum(c.get('total_commits', 0) for c in contributors)
-            total_lines_added = sum(c.get('total_lines_added', 0) for c in contributors)
-            total_lines_deleted = sum(c.get('total_lines_deleted', 0) for c in contributors)
+            commits = commits_future.result()
+            status_counts = dashboard_future.result()['status_counts']
             
-            # Task statistics
-            completed_tasks = [t for t in all_tasks if t.get('status') == 'completed']
-            in_progress_tasks = [t for t in all_tasks if t.get('status') == 'in_progress']
-            pending_tasks = [t for t in all_tasks if t.get('status') == 'pending']
+            total_commits = commits.get('total_commits', 0)
+            total_lines_added = commits.get('total_lines_added', 0)
+            total_lines_deleted = commits.get('total_lines_deleted', 0)
             
-            # Top contributors
-            top_contributors = sorted(
-                contributors,
-                key=lambda x: x.get('total_commits', 0),
-                reverse=True
-            )[:5]
+            completed = status_counts.get('completed', 0)
+            total_tasks = sum(status_counts.values())
             
             return {
                 'total_commits': total_commits,
                 'total_lines_added': total_lines_added,
                 'total_lines_deleted': total_lines_deleted,
                 'total_lines_changed': total_lines_added + total_lines_deleted,
-                'top_contributors': top_contributors,
+                'top_contributors': top_future.result(),
                 'tasks': {
-                    'completed': len(completed_tasks),
-                    'in_progress': len(in_progress_tasks),
-                    'pending': len(pending_tasks),
-                    'total': len(all_tasks)
+                    'completed': completed,
+                    'in_progress': status_counts.get('in_progress', 0),
+                    'pending': status_counts.get('pending', 0),
+                    'total': total_tasks
                 },
-                'completion_rate': len(completed_tasks) / len(all_tasks) * 100 if all_tasks else 0
+                'completion_rate': completed / total_tasks * 100 if total_tasks else 0
             }
         except Exception as e:
             print(f"Error getting team performance: {e}")
@@ -106,96 +294,98 @@ class MongoDBService:
     def get_project_health(self) -> Dict[str, Any]:
         """Get project health metrics"""
         try:
-            all_tasks = list(self.tasks.find())
+            # Status counts and the overdue subset, both computed by MongoDB
+            dashboard = self._compute_dashboard()
+            
+            status_counts = dashboard['status_counts']
+            total = sum(status_counts.values())
             
-            if not all_tasks:
+            if not total:
                 return {'status': 'no_data'}
             
-            completed = len([t for t in all_tasks if t.get('status') == 'completed'])
-            in_progress = len([t for t in all_tasks if t.get('status') == 'in_progress'])
-            pending = len([t for t in all_tasks if t.get('status') == 'pending'])
-            total = len(all_tasks)
+            completed = status_counts.get('completed', 0)
+            in_progress = status_counts.get('in_progress', 0)
+            pending = status_counts.get('pending', 0)
             
             # Calculate completion percentage
             completion_percentage = (completed / total * 100) if total > 0 else 0
             
-            # Check for overdue tasks
-            overdue_tasks = []
-            for task in all_tasks:
-                if task.get('deadline'):
-                    deadline = task['deadline']
-                    if isinstance(deadline, str):
-                        try:
-                            deadline = datetime.fromisoformat(deadline.replace('Z', '+00:00'))
-                        except:
-                            continue
-                    if deadline < datetime.now() and task.get('status') != 'completed':
-                        overdue_tasks.append(task)
-            
             return {
                 'total_tasks': total,
                 'completed': completed,
                 'in_progress': in_progress,
                 'pending': pending,
                 'completion_percentage': completion_percentage,
-                'overdue_count': len(overdue_tasks),
-                'overdue_tasks': overdue_tasks[:5],  # Top 5 overdue
+                'overdue_count': dashboard['overdue_count'],
+                'overdue_tasks': dashboard['overdue_tasks'],  # Top 5 overdue
                 'status': 'on_track' if completion_percentage > 60 else 'at_risk'
             }
         except Exception as e:
             print(f"Error getting project health: {e}")
             return {'status': 'error'}
     
-    def get_blockers(self) -> List[Dict[str, Any]]:
-        """Identify potential blockers"""
+    def get_blockers(self) -> Optional[List[Dict[str, Any]]]:
+        """Identify potential blockers (None if the query failed, [] if there are none)"""
         try:
-            blockers = []
-            
-            # High priority pending tasks
-            high_priority_pending = list(self.tasks.find({
-                'priority': {'$in': ['high', 'critical']},
-                'status': {'$in': ['pending', 'blocked']}
-            }))
+            high_priorities = ['high', 'critical']
+            open_statuses = ['pending', 'blocked']
             
-            for task in high_priority_pending:
-                blockers.append({
-                    'type': 'high_priority_pending',
-                    'task': task,
-                    'severity': 'high'
-                })
+            # High priority pending tasks and overdue tasks in one query,
+            # high priority first, then the longest overdue
+            pipeline = [
+                {'$match': {'$or': [
+                    {'priority': {'$in': high_priorities}, 'status': {'$in': open_statuses}},
+                    self._overdue_filter(datetime.now(timezone.utc))
+                ]}},
+                {'$addFields': {'high_priority_pending': {'$and': [
+                    {'$in': ['$priority', high_priorities]},
+                    {'$in': ['$status', open_statuses]}
+                ]}}},
+                {'$sort': {'high_priority_pending': -1, 'deadline': 1}},
+                {'$limit': 10},
+                {'$project': {**self.TASK_FIELDS, 'high_priority_pending': 1}}
+            ]
             
-            # Overdue tasks
-            all_tasks = list(self.tasks.find())
-            for task in all_tasks:
-                if task.get('deadline'):
-                    deadline = task['deadline']
-                    if isinstance(deadline, str):
-                        try:
-                            deadline = datetime.fromisoformat(deadline.replace('Z', '+00:00'))
-                        except:
-                            continue
-                    if deadline < datetime.now() and task.get('status') != 'completed':
-                        blockers.append({
-                            'type': 'overdue',
-                            'task': task,
-                            'severity': 'medium'
-                        })
+            blockers = []
+            for task in self.tasks.aggregate(pipeline):
+                if task.pop('high_priority_pending'):
+                    blockers.append({
+                        'type': 'high_priority_pending',
+                        'task': task,
+                        'severity': 'high'
+                    })
+                else:
+                    blockers.append({
+                        'type': 'overdue',
+                        'task': task,
+                        'severity': 'medium'
+                    })
             
-            return blockers[:10]  # Top 10 blockers
+            return blockers  # Top 10 blockers
         except Exception as e:
             print(f"Error getting blockers: {e}")
-            return []
+            return None
     
     def get_individual_contribution(self, user_name: str) -> Dict[str, Any]:
         """Get detailed contribution for a user"""
         try:
-            github_user = self.github_data.find_one(
-                {'name': {'$regex': user_name, '$options': 'i'}}
-            )
+            # Skip both lookups for names that match nobody
+            names = self._resolve_names(user_name)
+            if not names:
+                return {'status': 'user_not_found'}
+            
+            name_filter = {'$in': names}
             
-            jira_user = self.jira_data.find_one(
-                {'name': {'$regex': user_name, '$options': 'i'}}
+            # Get GitHub and Jira data concurrently
+            github_future = self._executor.submit(
+                self.github_data.find_one, {'name': name_filter}, self.RECENT_COMMITS_FIELDS
             )
+            jira_future = self._executor.submit(
+                self.jira_data.find_one, {'name': name_filter}, self.JIRA_FIELDS
+            )
+            
+            github_user = github_future.result()
+            jira_user = jira_future.result()
             
             if not github_user and not jira_user:
                 return {'status': 'user_not_found'}
@@ -217,13 +407,13 @@ class MongoDBService:
             
             if jira_user:
                 tickets = jira_user.get('tickets', [])
-                completed = [t for t in tickets if t.get('status') == 'Done']
-                in_progress = [t for t in tickets if t.get('status') == 'In Progress']
+                # One pass over the tickets for every status count
+                status_counts = Counter(t.get('status') for t in tickets)
                 
                 result['jira'] = {
                     'total_tickets': len(tickets),
-                    'completed': len(completed),
-                    'in_progress': len(in_progress),
+                    'completed': status_counts['Done'],
+                    'in_progress': status_counts['In Progress'],
                     'recent_tickets': tickets[:5]
                 }
             
@@ -234,6 +424,7 @@ class MongoDBService:
     
     def close(self):
         """Close MongoDB connection"""
+        self._executor.shutdown(wait=False)
         self.client.close()
 
 
@@ -246,6 +437,10 @@ if __name__ == '__main__':
     
     print("Testing MongoDB Service...")
     
+    # One task query; both methods below reuse its result
+    dashboard = service._compute_dashboard()
+    print(f"   Task statuses: {dashboard['status_counts']}")
+    
     # Test team performance
     print("\n1. Team Performance:")
     perf = service.get_team_performance()
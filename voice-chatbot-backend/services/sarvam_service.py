@@ -3,10 +3,45 @@ Sarvam AI Service - TTS and STT Integration
 Handles Text-to-Speech and Speech-to-Text using Sarvam AI API
 """
 
-import requests
+import httpx
+import asyncio
 import os
+import io
+import re
+import wave
 import base64
-from typing import Optional, Dict, Any
+import binascii
+import hashlib
+import struct
+import pybase64
+import tempfile
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Union, BinaryIO, AsyncIterator
+
+try:
+    from services.common import SENTENCE_BOUNDARY, UpstreamLimit
+except ImportError:  # Run as a script from services/
+    from common import SENTENCE_BOUNDARY, UpstreamLimit
+
+try:
+    import soundfile
+except ImportError:  # Optional (needs libsndfile), uploads are then sent as recorded
+    soundfile = None
+
+# Chunk size for streamed audio responses
+STREAM_CHUNK_SIZE = 32 * 1024
+
+# Data length advertised in a WAV header whose total size isn't known yet
+_STREAMING_DATA_SIZE = 0xFFFFFFFF
+
+# Rendered introduction clips, reused across restarts
+INTRO_CACHE_DIR = Path(__file__).resolve().parent.parent / 'cache'
+
+# WAV sample formats FLAC stores exactly, with the dtype that reads them without rescaling
+_FLAC_SUBTYPES = {'PCM_16': 'int16', 'PCM_24': 'int32'}
+
+# Start of the first base64 clip in a raw TTS response body
+_AUDIOS_FIELD = re.compile(rb'"audios"\s*:\s*\[\s*"')
 
 class SarvamService:
     def __init__(self):
@@ -18,11 +53,45 @@ class SarvamService:
         
         # Sarvam AI uses 'api-subscription-key' header
         self.headers = {
-            'api-subscription-key': self.api_key,
-            'Content-Type': 'application/json'
+            'api-subscription-key': self.api_key
+        }
+        
+        # Pooled HTTP/2 client shared by all requests, opened by startup()
+        self.client: Optional[httpx.AsyncClient] = None
+        
+        # In-flight call limit per endpoint
+        self.limits = {
+            'stt': UpstreamLimit(int(os.getenv('STT_CONCURRENCY', 20))),
+            'tts': UpstreamLimit(int(os.getenv('TTS_CONCURRENCY', 20)))
         }
+        
+        # Introduction audio by cache key, so only the first request touches disk
+        self._intro_audio: Dict[str, bytes] = {}
+    
+    async def startup(self):
+        """Open the pooled HTTP client (call from the serving event loop)"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=True,
+                timeout=30.0,
+                # Keep idle connections for a minute (httpx default: 5 s) so the
+                # next voice turn reuses the TLS session instead of handshaking again
+                limits=httpx.Limits(
+                    max_connections=64,
+                    max_keepalive_connections=32,
+                    keepalive_expiry=60.0
+                )
+            )
+    
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
     
-    def text_to_speech(
+    async def text_to_speech(
         self, 
         text: str, 
         language: str = 'hi-IN',  # Hindi by default
@@ -59,14 +128,14 @@ class SarvamService:
                 'model': model
             }
             
-            response = requests.post(
-                f'{self.base_url}/text-to-speech',
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            async with self.limits['tts']:
+                response = await self.client.post('/text-to-speech', json=payload)
             
             if response.status_code == 200:
+                audio_bytes = _decode_first_audio(response.content)
+                if audio_bytes:
+                    return audio_bytes
+                
                 result = response.json()
                 # Sarvam returns base64 encoded audio
                 if 'audios' in result and len(result['audios']) > 0:
@@ -84,44 +153,145 @@ class SarvamService:
             print(f"TTS Exception: {str(e)}")
             return None
     
-    def speech_to_text(
+    def _synthesize_sentences(
+        self,
+        text: str,
+        language: str,
+        speaker: str,
+        max_concurrency: int,
+        pace: float = 1.3
+    ) -> List[asyncio.Task]:
+        """Start one TTS task per sentence of text, at most max_concurrency at a time"""
+        sentences = [s.strip() for s in SENTENCE_BOUNDARY.split(text.strip()) if s.strip()]
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def synthesize(sentence: str) -> Optional[bytes]:
+            async with semaphore:
+                return await self.text_to_speech(sentence, language=language, speaker=speaker, pace=pace)
+        
+        return [asyncio.create_task(synthesize(sentence)) for sentence in sentences]
+    
+    async def text_to_speech_sentences(
+        self,
+        text: str,
+        language: str = 'hi-IN',
+        speaker: str = 'rahul',
+        max_concurrency: int = 4,
+        pace: float = 1.3
+    ) -> Optional[bytes]:
+        """
+        Convert text to speech as one WAV, synthesizing its sentences concurrently
+        
+        Takes about as long as the slowest sentence rather than the whole text.
+        
+        Returns:
+            Audio bytes in WAV format, or None if any sentence failed
+        """
+        tasks = self._synthesize_sentences(text, language, speaker, max_concurrency, pace)
+        try:
+            clips = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        if not clips or not all(clips):
+            return None
+        
+        return join_wav(clips)
+    
+    async def text_to_speech_stream(
+        self,
+        text: str,
+        language: str = 'hi-IN',
+        speaker: str = 'rahul',
+        max_concurrency: int = 4
+    ) -> AsyncIterator[bytes]:
+        """
+        Convert text to speech and stream it as one WAV, sentence by sentence
+        
+        Sentences are synthesized concurrently. The WAV header is yielded as
+        soon as the first sentence is ready, followed by every sentence's PCM
+        frames in order, so playback can begin before the rest is synthesized.
+        If a sentence fails, the stream ends there; when that is the first
+        sentence, nothing is yielded.
+        
+        Args:
+            text: Text to convert to speech
+            language: Language code (hi-IN for Hindi, en-IN for Indian English)
+            speaker: Voice name
+            max_concurrency: Maximum sentences synthesized at once
+        
+        Yields:
+            WAV bytes in chunks of at most STREAM_CHUNK_SIZE
+        """
+        tasks = self._synthesize_sentences(text, language, speaker, max_concurrency)
+        try:
+            header_sent = False
+            for index, task in enumerate(tasks, 1):
+                clip = await task
+                if not clip:
+                    # Skipping it would play the rest with speech missing; end the stream instead
+                    print(f"TTS failed for sentence {index}/{len(tasks)}, ending audio stream")
+                    return
+                
+                with wave.open(io.BytesIO(clip), 'rb') as reader:
+                    if not header_sent:
+                        yield _wav_header(
+                            reader.getnchannels(),
+                            reader.getsampwidth(),
+                            reader.getframerate(),
+                            _STREAMING_DATA_SIZE
+                        )
+                        header_sent = True
+                    frames = reader.readframes(reader.getnframes())
+                
+                for offset in range(0, len(frames), STREAM_CHUNK_SIZE):
+                    yield frames[offset:offset + STREAM_CHUNK_SIZE]
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def speech_to_text(
         self, 
-        audio_data: bytes,
+        audio_data: Union[bytes, BinaryIO],
         language: str = 'hi-IN'
     ) -> Optional[str]:
         """
         Convert speech to text using Sarvam AI Saarika STT
         
         Args:
-            audio_data: Audio bytes (WAV format)
+            audio_data: Audio bytes or a file-like stream (WAV format);
+                streams are uploaded in chunks without being read into memory
             language: Language code (hi-IN for Hindi, en-IN for English)
         
         Returns:
             Transcribed text
         """
         try:
-            # Sarvam AI STT requires multipart/form-data with file upload
-            files = {
-                'file': ('audio.wav', audio_data, 'audio/wav')
-            }
+            # Uncompressed WAV is re-encoded as lossless FLAC to shrink the upload
+            flac = await asyncio.to_thread(_encode_flac, audio_data)
             
-            # Remove Content-Type from headers for multipart
-            headers = {
-                'api-subscription-key': self.api_key
-            }
+            # Sarvam AI STT requires multipart/form-data with file upload
+            if flac is not None:
+                files = {
+                    'file': ('audio.flac', flac, 'audio/flac')
+                }
+            else:
+                files = {
+                    'file': ('audio.wav', audio_data, 'audio/wav')
+                }
             
             data = {
                 'language_code': language,
                 'model': 'saarika:v2.5'  # Updated to v2.5
             }
             
-            response = requests.post(
-                f'{self.base_url}/speech-to-text',
-                headers=headers,
-                files=files,
-                data=data,
-                timeout=30
-            )
+            async with self.limits['stt']:
+                response = await self.client.post(
+                    '/speech-to-text',
+                    files=files,
+                    data=data
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -138,10 +308,15 @@ class SarvamService:
             print(f"STT Exception: {str(e)}")
             return None
     
-    def get_introduction_audio(self, language: str = 'hi-IN') -> Optional[bytes]:
+    async def get_introduction_audio(self, language: str = 'hi-IN') -> Optional[bytes]:
         """
         Generate introduction message audio
         
+        Each sentence is synthesized concurrently and the clips are joined, so
+        this takes about as long as the slowest sentence, not the paragraph.
+        The result is cached in memory and under INTRO_CACHE_DIR, keyed by
+        everything that shapes the audio, so Sarvam is only called once.
+        
         Returns:
             Audio bytes for introduction
         """
@@ -159,19 +334,153 @@ class SarvamService:
             How can I help you today?
             """
         
-        return self.text_to_speech(intro_text, language=language)
+        speaker = 'rahul'
+        pace = 1.3
+        key = hashlib.sha1(f'{language}|{speaker}|{pace}|{intro_text}'.encode()).hexdigest()
+        
+        audio = self._intro_audio.get(key)
+        if audio:
+            return audio
+        
+        path = INTRO_CACHE_DIR / f'intro_{key}.wav'
+        try:
+            audio = await asyncio.to_thread(path.read_bytes)
+        except OSError:
+            audio = await self.text_to_speech_sentences(intro_text, language, speaker, 4, pace)
+            if not audio:
+                return None
+            
+            try:
+                await asyncio.to_thread(_write_atomic, path, audio)
+            except OSError as e:
+                print(f"Intro cache write error: {e}")
+        
+        self._intro_audio[key] = audio
+        return audio
 
 
-# Test function
-if __name__ == '__main__':
-    from dotenv import load_dotenv
-    load_dotenv()
+def _decode_first_audio(content: bytes) -> Optional[bytes]:
+    """
+    Decode the first clip of a TTS response straight from the raw body
+    
+    Slices the base64 string out of the JSON bytes and decodes it in C, so the
+    ~100 KB string is never parsed into a Python str first. Returns None when
+    the body doesn't have the expected shape, so callers fall back to JSON.
+    """
+    match = _AUDIOS_FIELD.search(content)
+    if match is None:
+        return None
+    
+    start = match.end()
+    end = content.find(b'"', start)
+    # Escaped characters mean the slice isn't plain base64
+    if end == -1 or content.find(b'\\', start, end) != -1:
+        return None
+    
+    try:
+        return pybase64.b64decode(memoryview(content)[start:end], validate=True)
+    except binascii.Error:
+        return None
+
+
+def _write_atomic(path: Path, data: bytes):
+    """Write data to path via a temporary file, so readers never see a partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    
+    # A unique name per call, so concurrent writers (threads or workers) never share a temp file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _encode_flac(audio_data: Union[bytes, BinaryIO]) -> Optional[bytes]:
+    """
+    Re-encode 16/24-bit PCM WAV audio as FLAC (lossless, roughly half the size)
+    
+    Returns None, leaving the upload untouched, when soundfile isn't installed,
+    the audio isn't a WAV file (browsers usually record WebM/Opus, which is
+    already compressed) or its samples aren't a FLAC-compatible PCM format
+    (float, 32-bit, 8-bit). Streams are rewound to where they started.
+    Converted audio is decoded in full, so it is held in memory once.
+    """
+    if soundfile is None:
+        return None
     
+    source = io.BytesIO(audio_data) if isinstance(audio_data, (bytes, bytearray)) else audio_data
+    try:
+        start = source.tell()
+        magic = source.read(12)
+        source.seek(start)
+    except (AttributeError, OSError):
+        return None
+    
+    if magic[:4] != b'RIFF' or magic[8:12] != b'WAVE':
+        return None
+    
+    try:
+        subtype = soundfile.info(source).subtype
+        source.seek(start)
+        if subtype not in _FLAC_SUBTYPES:
+            return None
+        
+        data, sample_rate = soundfile.read(source, dtype=_FLAC_SUBTYPES[subtype])
+        buffer = io.BytesIO()
+        soundfile.write(buffer, data, sample_rate, format='FLAC', subtype=subtype)
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"FLAC encode error: {e}")
+        source.seek(start)
+        return None
+
+
+def _wav_header(channels: int, sample_width: int, frame_rate: int, data_size: int) -> bytes:
+    """Build a 44-byte PCM WAV header"""
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', min(36 + data_size, 0xFFFFFFFF), b'WAVE',
+        b'fmt ', 16, 1, channels, frame_rate,
+        frame_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+        b'data', data_size
+    )
+
+
+def join_wav(clips: List[bytes]) -> bytes:
+    """
+    Concatenate WAV clips that share the same format into a single WAV
+    
+    Args:
+        clips: WAV files as returned by text_to_speech, in playback order
+    
+    Returns:
+        One WAV file containing all clips back to back
+    """
+    if len(clips) == 1:
+        return clips[0]
+    
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as writer:
+        for index, clip in enumerate(clips):
+            with wave.open(io.BytesIO(clip), 'rb') as reader:
+                if index == 0:
+                    writer.setparams(reader.getparams())
+                writer.writeframes(reader.readframes(reader.getnframes()))
+    
+    return output.getvalue()
+
+
+# Test function
+async def _main():
     service = SarvamService()
+    await service.startup()
     
     # Test TTS
     print("Testing Text-to-Speech...")
-    audio = service.text_to_speech(
+    audio = await service.text_to_speech(
         "Hello, this is a test of Sarvam AI voice synthesis.",
         language='en-IN'
     )
@@ -187,8 +496,18 @@ if __name__ == '__main__':
     
     # Test introduction
     print("\nTesting Introduction...")
-    intro_audio = service.get_introduction_audio('en-IN')
+    intro_audio = await service.get_introduction_audio('en-IN')
     if intro_audio:
         print(f"✅ Introduction Success! Generated {len(intro_audio)} bytes")
     else:
         print("❌ Introduction Failed")
+    
+    await service.aclose()
+
+
+if __name__ == '__main__':
+    import asyncio
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    asyncio.run(_main())
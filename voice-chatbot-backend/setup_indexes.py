@@ -0,0 +1,24 @@
+"""
+Index Setup
+Creates the MongoDB indexes the chatbot's lookups rely on
+
+Run once per database from voice-chatbot-backend/ (safe to re-run; existing
+indexes are left as they are):
+
+    python setup_indexes.py
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services.mongodb_service import MongoDBService
+
+if __name__ == '__main__':
+    service = MongoDBService()
+    
+    try:
+        service.ensure_indexes()
+        print("✅ Indexes are in place")
+    finally:
+        service.close()